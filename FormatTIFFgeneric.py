@@ -3,22 +3,287 @@ detectors producing electron diffraction data"""
 
 import os
 import io
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import struct
+from collections import namedtuple
 from dxtbx.format.Format import Format
 from dxtbx.format.FormatStill import FormatStill
 from scitbx.array_family import flex
 import re
+import numpy as np
+from boost.python import streambuf
 from dxtbx import flumpy
+from dxtbx.ext import read_uint8, read_uint16, read_uint16_bs
 
 try:
     import tifffile
 except ImportError:
     tifffile = None
 
+# Opt-in switches for the less specific formats below, read once on import
+_MERLIN_ENABLED = os.getenv("QD_MERLIN_TIFF") is not None
+_UED_BNL_ENABLED = os.getenv("UED_BNL_TIFF") is not None
+
+# Trailing image number in a filename stem
+_TRAILING_INT = re.compile(r"([0-9]+)$")
+
+
+@functools.lru_cache(maxsize=4096)
+def _image_number(image_file):
+    """Image number for a file, cached because dxtbx constructs a new Format
+    instance, and so a new scan, each time an image is read"""
+
+    fname = os.path.basename(image_file)
+    # assume that the final number before the extension is the image number
+    s = fname.rpartition("_")[2].partition(".")[0]
+    match = _TRAILING_INT.search(s)
+    return int(match.group(1)) if match else 1
+
+
+# Dummy scans have 0.5 deg images. make_scan only reads epochs, indexing it by
+# its own sorted values, so the single entry must be the integer 0
+_OSC_WIDTH = 0.5
+_EPOCHS = (0,)
+
+# Fixed geometry of the dummy beams. The beams themselves are built afresh for
+# each Format instance, as dxtbx models are mutable and may be overridden on
+# import
+_BEAM_POLARIZATION = {
+    "sample_to_source": (0.0, 0.0, 1.0),
+    "polarization": (0, 1, 0),
+    "polarization_fraction": 0.5,
+}
+
+# Readers that fill a flex.int straight from a file, keyed by numpy type string
+_FLEX_READERS = {"|u1": read_uint8, "<u2": read_uint16, ">u2": read_uint16_bs}
+
+
+def _fits_int32(dtype):
+    """Whether integer pixels of this type, in either byte order, can be held
+    losslessly in a flex.int"""
+
+    return dtype.kind in "iu" and (
+        dtype.itemsize < 4 or (dtype.kind == "i" and dtype.itemsize == 4)
+    )
+
+
+def _to_flex(raw_data):
+    """Convert a numpy image to a flex array without a float64 upcast. Integer
+    data that fit in 32 bits become flex.int, anything else flex.double. A
+    memory-mapped image is copied into memory once, during the conversion"""
+
+    # Floating point data stay double precision: dxtbx image sets are built from
+    # flex.int or flex.double only, so a flex.float would be rejected (or
+    # widened again) downstream
+    if _fits_int32(raw_data.dtype):
+        dtype = np.int32
+    else:
+        dtype = np.float64
+    return flumpy.from_numpy(
+        np.require(raw_data, dtype=dtype, requirements=["C", "W", "O"])
+    )
+
+
+# The parts of a TIFF header that the understand methods below look at
+_TiffProbe = namedtuple(
+    "_TiffProbe", ["n_pages", "n_series", "shape", "description", "camera_name"]
+)
+
+
+def _cache_key(image_file):
+    """Key for the header caches below. The file modification time and size
+    form part of it, so a file that is rewritten will be parsed again."""
+
+    st = os.stat(image_file)
+    return image_file, st.st_mtime_ns, st.st_size
+
+
+def _probe(image_file):
+    """Return a _TiffProbe for image_file, or None if it is not a TIFF. dxtbx
+    tries each format class in turn, so the result is cached to avoid parsing
+    the same file repeatedly."""
+
+    return _probe_cached(*_cache_key(image_file))
+
+
+@functools.lru_cache(maxsize=128)
+def _probe_cached(image_file, mtime, size):
+    try:
+        tif = tifffile.TiffFile(image_file)
+    except tifffile.TiffFileError:
+        return None
+
+    with tif:
+        page = tif.pages[0]
+        description = page.tags.get(270)
+        if description is not None:
+            description = description.value
+        try:
+            camera_name = page.tags[33560].value["cameraname"]
+        except (KeyError, TypeError):
+            camera_name = None
+        return _TiffProbe(
+            len(tif.pages), len(tif.series), page.shape, description, camera_name
+        )
+
+
+# TIFF byte order marks and, for classic and BigTIFF files, the struct formats
+# for an offset, the IFD entry count and a single IFD entry
+_TIFF_BYTE_ORDER = {b"II": "<", b"MM": ">"}
+_TIFF_IFD_FORMATS = {42: ("I", "H", "HHI4s"), 43: ("Q", "Q", "HHQ8s")}
+_TIFF_VALUE_FORMATS = {1: "B", 3: "H", 4: "I", 16: "Q"}
+
+# The tags of the first IFD that _fast_header extracts: ImageWidth, ImageLength,
+# BitsPerSample, Compression, StripOffsets, SamplesPerPixel, StripByteCounts and
+# SampleFormat
+_HEADER_TAGS = frozenset((256, 257, 258, 259, 273, 277, 279, 339))
+
+# numpy type codes for (SampleFormat, BitsPerSample)
+_TIFF_DTYPES = {
+    (1, 8): "u1",
+    (1, 16): "u2",
+    (1, 32): "u4",
+    (2, 8): "i1",
+    (2, 16): "i2",
+    (2, 32): "i4",
+    (3, 32): "f4",
+    (3, 64): "f8",
+}
+
+
+class _TiffHeader(
+    namedtuple(
+        "_TiffHeader", ["byte_order", "tags", "next_ifd", "file_size", "truncated"]
+    )
+):
+    """Tags of interest from the first IFD of a TIFF file, read without
+    tifffile. next_ifd is the offset of the second IFD, zero for a single page
+    file or None if the header could not be interpreted. truncated is set if
+    the first IFD, or a value of interest it points to, lies beyond the end of
+    the file."""
+
+    @property
+    def shape(self):
+        """(ImageLength, ImageWidth) of the first page, or None if not known"""
+
+        try:
+            return self.tags[257][0], self.tags[256][0]
+        except (KeyError, IndexError):
+            return None
+
+    def uncompressed_layout(self):
+        """(offset, dtype) of the pixel data of the first page, if it is stored
+        uncompressed with one sample per pixel in strips that follow on from
+        each other without gaps. Otherwise None."""
+
+        tags = self.tags
+        shape = self.shape
+        if shape is None or tags.get(259, (1,)) != (1,) or tags.get(277, (1,)) != (1,):
+            return None
+        code = _TIFF_DTYPES.get((tags.get(339, (1,))[0], tags.get(258, (1,))[0]))
+        offsets = tags.get(273)
+        counts = tags.get(279)
+        if code is None or not offsets or not counts or len(offsets) != len(counts):
+            return None
+        for offset, previous, count in zip(offsets[1:], offsets, counts):
+            if offset != previous + count:
+                return None
+        dtype = np.dtype(self.byte_order + code)
+        nbytes = shape[0] * shape[1] * dtype.itemsize
+        if sum(counts) < nbytes:
+            return None
+        # A partially written file is left for tifffile to reject
+        if offsets[0] + nbytes > self.file_size:
+            return None
+        return offsets[0], dtype
+
+
+def _fast_header(image_file):
+    """Return a _TiffHeader for image_file, or None if it does not start with
+    a TIFF byte order mark. Cached in the same way as _probe."""
+
+    return _fast_header_cached(*_cache_key(image_file))
+
+
+@functools.lru_cache(maxsize=128)
+def _fast_header_cached(image_file, mtime, size):
+    with open(image_file, "rb") as f:
+        head = f.read(16)
+        byte_order = _TIFF_BYTE_ORDER.get(head[:2])
+        if byte_order is None:
+            return None
+        try:
+            tags, next_ifd = _read_first_ifd(f, byte_order, head, size)
+        except _TruncatedHeader:
+            return _TiffHeader(byte_order, {}, None, size, True)
+        except (struct.error, OverflowError, ValueError):
+            # Leave anything unexpected for tifffile to decide
+            tags, next_ifd = {}, None
+    return _TiffHeader(byte_order, tags, next_ifd, size, False)
+
+
+class _TruncatedHeader(Exception):
+    """The first IFD, or a value it points to, lies beyond the end of the file"""
+
+
+def _read_first_ifd(f, byte_order, head, size):
+    """Read the values of _HEADER_TAGS and the offset of the next IFD from the
+    first IFD of an open TIFF file of the given size. Every offset and length
+    is checked against the size before it is used, and _TruncatedHeader raised
+    if it does not fit."""
+
+    version = struct.unpack_from(byte_order + "H", head, 2)[0]
+    if version not in _TIFF_IFD_FORMATS:
+        return {}, None
+    offset_fmt, count_fmt, entry_fmt = (
+        byte_order + fmt for fmt in _TIFF_IFD_FORMATS[version]
+    )
+    offset_size, count_size, entry_size = (
+        struct.calcsize(fmt) for fmt in (offset_fmt, count_fmt, entry_fmt)
+    )
+    ifd_offset = struct.unpack_from(offset_fmt, head, 8 if version == 43 else 4)[0]
+    if ifd_offset + count_size > size:
+        raise _TruncatedHeader()
+    f.seek(ifd_offset)
+    n_entries = struct.unpack(count_fmt, f.read(count_size))[0]
+    if ifd_offset + count_size + n_entries * entry_size + offset_size > size:
+        raise _TruncatedHeader()
+    entries = f.read(n_entries * entry_size)
+    next_ifd = struct.unpack(offset_fmt, f.read(offset_size))[0]
+
+    # Values are stored left-justified in the value field of the entry if they
+    # fit, otherwise that field holds an offset to them
+    tags = {}
+    for tag, dtype, count, value in struct.iter_unpack(entry_fmt, entries):
+        if tag not in _HEADER_TAGS:
+            continue
+        fmt = _TIFF_VALUE_FORMATS.get(dtype)
+        if fmt is None:
+            continue
+        nbytes = count * struct.calcsize(byte_order + fmt)
+        fmt = "%s%d%s" % (byte_order, count, fmt)
+        if nbytes > len(value):
+            value_offset = struct.unpack(offset_fmt, value)[0]
+            if value_offset + nbytes > size:
+                raise _TruncatedHeader()
+            f.seek(value_offset)
+            tags[tag] = struct.unpack(fmt, f.read(nbytes))
+        else:
+            tags[tag] = struct.unpack_from(fmt, value)
+    return tags, next_ifd
+
 
 class FormatTIFFgeneric(Format):
     """General-purpose TIFF image reader using tifffile. This will clash with
     the dxtbx FormatTIFF tree for Rigaku/Bruker TIFFs."""
 
+    # Dummy model defaults for _build_beam and _build_detector. Detector-specific
+    # subclasses also set PIXEL_SIZE, IMAGE_SIZE and TRUSTED_RANGE
+    WAVELENGTH = 0.02508
+    SENSOR = "PAD"
+    DISTANCE = 2440
+
     @staticmethod
     def understand(image_file):
         """Check to see if this looks like a TIFF format image with a single page"""
@@ -29,45 +294,105 @@ class FormatTIFFgeneric(Format):
             )
             return False
 
-        try:
-            tif = tifffile.TiffFile(image_file)
-        except tifffile.TiffFileError:
+        # Reject files that are not TIFFs, are cut short, or have a second page,
+        # before parsing them with tifffile. Both caches share one stat of the file
+        key = _cache_key(image_file)
+        header = _fast_header_cached(*key)
+        if header is None or header.truncated or header.next_ifd:
             return False
 
-        try:
-            assert len(tif.pages) == 1
-            assert len(tif.series) == 1
-            page = tif.pages[0]
-        except (AssertionError, KeyError):
+        probe = _probe_cached(*key)
+        if probe is None:
             return False
-        finally:
-            tif.close()
 
-        return True
+        return probe.n_pages == 1 and probe.n_series == 1
+
+    @classmethod
+    def understand_batch(cls, image_files, max_workers=None):
+        """Apply understand to many files using a pool of threads, returning a
+        list of results in the same order as image_files. As in the dxtbx
+        registry, a subclass is only asked about files that FormatTIFFgeneric
+        accepts. The parsing holds the GIL, so threads only overlap file reads."""
+
+        def understand(image_file):
+            if not FormatTIFFgeneric.understand(image_file):
+                return False
+            return cls is FormatTIFFgeneric or cls.understand(image_file)
+
+        with ThreadPoolExecutor(max_workers or os.cpu_count()) as executor:
+            return list(executor.map(understand, image_files))
+
+    def _start(self):
+        """Keep the header read while identifying the file, so that
+        get_raw_data can locate the pixel data without reading it again"""
+
+        self._header = _fast_header(self._image_file)
 
     def get_raw_data(self):
         """Get the pixel intensities"""
 
-        raw_data = tifffile.imread(self._image_file)
-        return flumpy.from_numpy(raw_data.astype(float))
+        # Uncompressed images can be read directly, rather than decoded into
+        # an intermediate buffer. Use the layout from the cached header where
+        # possible, to avoid parsing the file again with tifffile
+        header = self._header
+        if header is not None and header.truncated:
+            raise ValueError("TIFF header of %s is truncated" % self._image_file)
+        layout = header.uncompressed_layout() if header else None
+        if layout is not None:
+            offset, dtype = layout
+            read_pixel = _FLEX_READERS.get(dtype.str)
+            if read_pixel is not None:
+                slow, fast = header.shape
+                with self.open_file(self._image_file, "rb") as f:
+                    f.seek(offset)
+                    raw_data = read_pixel(streambuf(f), slow * fast)
+                raw_data.reshape(flex.grid(slow, fast))
+                return raw_data
+
+            raw_data = np.memmap(
+                self._image_file,
+                dtype=dtype,
+                mode="r",
+                offset=offset,
+                shape=header.shape,
+            )
+            return _to_flex(raw_data)
+
+        # Compressed, tiled or otherwise irregular images are decoded by tifffile
+        return _to_flex(tifffile.imread(self._image_file))
+
+    def _build_beam(self):
+        """Dummy polarized beam with the class attribute WAVELENGTH"""
+
+        return self._beam_factory.make_polarized_beam(
+            wavelength=self.WAVELENGTH, **_BEAM_POLARIZATION
+        )
+
+    def _build_detector(self):
+        """Dummy detector described by the class attributes SENSOR, DISTANCE,
+        PIXEL_SIZE, IMAGE_SIZE and TRUSTED_RANGE, with the beam centre in the
+        middle of the image"""
+
+        beam_centre = [(p * i) / 2 for p, i in zip(self.PIXEL_SIZE, self.IMAGE_SIZE)]
+        return self._detector_factory.simple(
+            self.SENSOR,
+            self.DISTANCE,
+            beam_centre,
+            "+x",
+            "-y",
+            self.PIXEL_SIZE,
+            self.IMAGE_SIZE,
+            self.TRUSTED_RANGE,
+        )
 
     def _scan(self):
         """Dummy scan for this image"""
 
-        fname = os.path.split(self._image_file)[-1]
-        # assume that the final number before the extension is the image number
-        s = fname.split("_")[-1].split(".")[0]
-        try:
-            index = int(re.match(".*?([0-9]+)$", s).group(1))
-        except AttributeError:
-            index = 1
-        exposure_times = 0.0
+        index = _image_number(self._image_file)
         frame = index - 1
-        # Dummy scan with a 0.5 deg image
-        oscillation = (frame * 0.5, 0.5)
-        epochs = [0]
+        oscillation = (frame * _OSC_WIDTH, _OSC_WIDTH)
         return self._scan_factory.make_scan(
-            (index, index), exposure_times, oscillation, epochs, deg=True
+            (index, index), 0.0, oscillation, _EPOCHS, deg=True
         )
 
 
@@ -85,19 +410,18 @@ class FormatTIFFgeneric_Merlin(FormatTIFFgeneric):
     containing a single 512x512 pixel image.
     """
 
+    PIXEL_SIZE = (0.055, 0.055)
+    IMAGE_SIZE = (512, 512)
+    TRUSTED_RANGE = (-1, (1 << 12) - 1)
+
     @staticmethod
     def understand(image_file):
         """Check to see if this looks like a TIFF format image with a single page"""
 
-        if os.getenv("QD_MERLIN_TIFF") is None:
+        if not _MERLIN_ENABLED:
             return False
 
-        with tifffile.TiffFile(image_file) as tif:
-            page = tif.pages[0]
-            if page.shape != (512, 512):
-                return False
-
-        return True
+        return _probe(image_file).shape == (512, 512)
 
     def _goniometer(self):
         """Dummy goniometer, 'vertical' as the images are viewed. Not completely
@@ -108,26 +432,12 @@ class FormatTIFFgeneric_Merlin(FormatTIFFgeneric):
     def _beam(self):
         """Dummy beam, energy 200 keV"""
 
-        wavelength = 0.02508
-        return self._beam_factory.make_polarized_beam(
-            sample_to_source=(0.0, 0.0, 1.0),
-            wavelength=wavelength,
-            polarization=(0, 1, 0),
-            polarization_fraction=0.5,
-        )
+        return self._build_beam()
 
     def _detector(self):
         """Dummy detector"""
 
-        pixel_size = 0.055, 0.055
-        image_size = (512, 512)
-        dyn_range = 12
-        trusted_range = (-1, 2 ** dyn_range - 1)
-        beam_centre = [(p * i) / 2 for p, i in zip(pixel_size, image_size)]
-        d = self._detector_factory.simple(
-            "PAD", 2440, beam_centre, "+x", "-y", pixel_size, image_size, trusted_range
-        )
-        return d
+        return self._build_detector()
 
 
 class FormatTIFFgeneric_ASI(FormatTIFFgeneric):
@@ -135,21 +445,20 @@ class FormatTIFFgeneric_ASI(FormatTIFFgeneric):
     ASI hybrid pixel detector.
     """
 
+    PIXEL_SIZE = (0.055, 0.055)
+    IMAGE_SIZE = (516, 516)
+    TRUSTED_RANGE = (-1, (1 << 20) - 1)  # XXX ?
+
     @staticmethod
     def understand(image_file):
         """Check to see if this looks like a TIFF format 516*516 image with
         an expected string in the ImageDescription tag"""
 
-        with tifffile.TiffFile(image_file) as tif:
-
-            page = tif.pages[0]
-            if page.shape != (516, 516):
-                return False
-            ImageDescription = page.tags[270]
-            if not "ImageCameraName: timepix" in ImageDescription.value:
-                return False
+        probe = _probe(image_file)
+        if probe.shape != (516, 516) or probe.description is None:
+            return False
 
-        return True
+        return "ImageCameraName: timepix" in probe.description
 
     def _goniometer(self):
         """Dummy goniometer, 'vertical' as the images are viewed. Not completely
@@ -160,26 +469,12 @@ class FormatTIFFgeneric_ASI(FormatTIFFgeneric):
     def _beam(self):
         """Dummy beam, energy 200 keV"""
 
-        wavelength = 0.02508
-        return self._beam_factory.make_polarized_beam(
-            sample_to_source=(0.0, 0.0, 1.0),
-            wavelength=wavelength,
-            polarization=(0, 1, 0),
-            polarization_fraction=0.5,
-        )
+        return self._build_beam()
 
     def _detector(self):
         """Dummy detector"""
 
-        pixel_size = 0.055, 0.055
-        image_size = (516, 516)
-        dyn_range = 20 # XXX ?
-        trusted_range = (-1, 2 ** dyn_range - 1)
-        beam_centre = [(p * i) / 2 for p, i in zip(pixel_size, image_size)]
-        d = self._detector_factory.simple(
-            "PAD", 2440, beam_centre, "+x", "-y", pixel_size, image_size, trusted_range
-        )
-        return d
+        return self._build_detector()
 
 
 class FormatTIFFgeneric_FEI_Tecnai_G2(FormatTIFFgeneric):
@@ -187,21 +482,21 @@ class FormatTIFFgeneric_FEI_Tecnai_G2(FormatTIFFgeneric):
     an FEI Tecnai G2 microscope with a CCD detector.
     """
 
+    # 2x2 binning https://cfim.ku.dk/equipment/electron_microscopy/cm100/Veleta.pdf
+    PIXEL_SIZE = (0.026, 0.026)
+    IMAGE_SIZE = (1024, 1024)
+    TRUSTED_RANGE = (-1, (1 << 14) - 1)  # XXX ?
+
     @staticmethod
     def understand(image_file):
         """Check to see if this looks like a TIFF format 516*516 image with
         an expected string in the ImageDescription tag"""
 
-        with tifffile.TiffFile(image_file) as tif:
-
-            page = tif.pages[0]
-            if page.shape != (1024, 1024):
-                return False
-            OlympusSIS = page.tags[33560]
-            if not "Veleta" in OlympusSIS.value["cameraname"]:
-                return False
+        probe = _probe(image_file)
+        if probe.shape != (1024, 1024) or probe.camera_name is None:
+            return False
 
-        return True
+        return "Veleta" in probe.camera_name
 
     def _goniometer(self):
         """Dummy goniometer, 'vertical' as the images are viewed. Not completely
@@ -212,27 +507,12 @@ class FormatTIFFgeneric_FEI_Tecnai_G2(FormatTIFFgeneric):
     def _beam(self):
         """Dummy beam, energy 200 keV"""
 
-        wavelength = 0.02508
-        return self._beam_factory.make_polarized_beam(
-            sample_to_source=(0.0, 0.0, 1.0),
-            wavelength=wavelength,
-            polarization=(0, 1, 0),
-            polarization_fraction=0.5,
-        )
+        return self._build_beam()
 
     def _detector(self):
         """Dummy detector"""
 
-        # 2x2 binning https://cfim.ku.dk/equipment/electron_microscopy/cm100/Veleta.pdf
-        pixel_size = 0.026, 0.026
-        image_size = (1024, 1024)
-        dyn_range = 14 # XXX ?
-        trusted_range = (-1, 2 ** dyn_range - 1)
-        beam_centre = [(p * i) / 2 for p, i in zip(pixel_size, image_size)]
-        d = self._detector_factory.simple(
-            "PAD", 2440, beam_centre, "+x", "-y", pixel_size, image_size, trusted_range
-        )
-        return d
+        return self._build_detector()
 
 class FormatTIFFgeneric_Medipix(FormatTIFFgeneric):
     """An experimental image reading class for TIFF images from a Medipix
@@ -247,16 +527,15 @@ class FormatTIFFgeneric_Medipix(FormatTIFFgeneric):
     containing a single 514x514 pixel image.
     """
 
+    PIXEL_SIZE = (0.055, 0.055)
+    IMAGE_SIZE = (514, 514)
+    TRUSTED_RANGE = (-1, (1 << 16) - 1)
+
     @staticmethod
     def understand(image_file):
         """Check to see if this looks like a TIFF format image with a single page"""
 
-        with tifffile.TiffFile(image_file) as tif:
-            page = tif.pages[0]
-            if page.shape != (514, 514):
-                return False
-
-        return True
+        return _probe(image_file).shape == (514, 514)
 
     def _goniometer(self):
         """Dummy goniometer, 'vertical' as the images are viewed. Not completely
@@ -267,26 +546,12 @@ class FormatTIFFgeneric_Medipix(FormatTIFFgeneric):
     def _beam(self):
         """Dummy beam, energy 200 keV"""
 
-        wavelength = 0.02508
-        return self._beam_factory.make_polarized_beam(
-            sample_to_source=(0.0, 0.0, 1.0),
-            wavelength=wavelength,
-            polarization=(0, 1, 0),
-            polarization_fraction=0.5,
-        )
+        return self._build_beam()
 
     def _detector(self):
         """Dummy detector"""
 
-        pixel_size = 0.055, 0.055
-        image_size = (514, 514)
-        dyn_range = 16
-        trusted_range = (-1, 2 ** dyn_range - 1)
-        beam_centre = [(p * i) / 2 for p, i in zip(pixel_size, image_size)]
-        d = self._detector_factory.simple(
-            "PAD", 2440, beam_centre, "+x", "-y", pixel_size, image_size, trusted_range
-        )
-        return d
+        return self._build_detector()
 
 
 class FormatTIFF_UED(FormatTIFFgeneric, FormatStill):
@@ -294,47 +559,25 @@ class FormatTIFF_UED(FormatTIFFgeneric, FormatStill):
     instrument. Most of this is probably incorrect.
     """
 
-    def __init__(self, image_file, **kwargs):
-
-        FormatTIFFgeneric.__init__(self, image_file, **kwargs)
-        FormatStill.__init__(self, image_file, **kwargs)
-
-        return
+    PIXEL_SIZE = (0.060, 0.060)
+    IMAGE_SIZE = (1300, 1340)
+    TRUSTED_RANGE = (-1, (1 << 20) - 1)  # No idea what is correct
 
     @staticmethod
     def understand(image_file):
         """Check to see if this looks like a TIFF format image with a single page"""
 
-        with tifffile.TiffFile(image_file) as tif:
-            page = tif.pages[0]
-            if page.shape != (1300, 1340):
-                return False
-
-        return True
+        return _probe(image_file).shape == (1300, 1340)
 
     def _beam(self):
         """Dummy beam, energy 200 keV"""
 
-        wavelength = 0.02508
-        return self._beam_factory.make_polarized_beam(
-            sample_to_source=(0.0, 0.0, 1.0),
-            wavelength=wavelength,
-            polarization=(0, 1, 0),
-            polarization_fraction=0.5,
-        )
+        return self._build_beam()
 
     def _detector(self):
         """Dummy detector"""
 
-        pixel_size = 0.060, 0.060
-        image_size = (1300, 1340)
-        dyn_range = 20 # No idea what is correct
-        trusted_range = (-1, 2 ** dyn_range - 1)
-        beam_centre = [(p * i) / 2 for p, i in zip(pixel_size, image_size)]
-        d = self._detector_factory.simple(
-            "PAD", 2440, beam_centre, "+x", "-y", pixel_size, image_size, trusted_range
-        )
-        return d
+        return self._build_detector()
 
 
 class FormatTIFF_UED_BNL(FormatTIFFgeneric, FormatStill):
@@ -344,47 +587,28 @@ class FormatTIFF_UED_BNL(FormatTIFFgeneric, FormatStill):
     Set environment variable UED_BNL_TIFF to use.
     """
 
-    def __init__(self, image_file, **kwargs):
-
-        FormatTIFFgeneric.__init__(self, image_file, **kwargs)
-        FormatStill.__init__(self, image_file, **kwargs)
-
-        return
+    WAVELENGTH = 0.03569
+    SENSOR = "CCD"
+    DISTANCE = 3480
+    PIXEL_SIZE = (0.016, 0.016)
+    IMAGE_SIZE = (512, 512)
+    TRUSTED_RANGE = (-1, (1 << 20) - 1)  # No idea what is correct
 
     @staticmethod
     def understand(image_file):
         """Check to see if this looks like a TIFF format image with a single page"""
 
-        if os.getenv("UED_BNL_TIFF") is None:
+        if not _UED_BNL_ENABLED:
             return False
 
-        with tifffile.TiffFile(image_file) as tif:
-            page = tif.pages[0]
-            if page.shape != (512, 512):
-                return False
-
-        return True
+        return _probe(image_file).shape == (512, 512)
 
     def _beam(self):
         """Dummy beam, energy 200 keV"""
 
-        wavelength = 0.03569
-        return self._beam_factory.make_polarized_beam(
-            sample_to_source=(0.0, 0.0, 1.0),
-            wavelength=wavelength,
-            polarization=(0, 1, 0),
-            polarization_fraction=0.5,
-        )
+        return self._build_beam()
 
     def _detector(self):
         """Dummy detector"""
 
-        pixel_size = 0.016, 0.016
-        image_size = (512, 512)
-        dyn_range = 20 # No idea what is correct
-        trusted_range = (-1, 2 ** dyn_range - 1)
-        beam_centre = [(p * i) / 2 for p, i in zip(pixel_size, image_size)]
-        d = self._detector_factory.simple(
-            "CCD", 3480, beam_centre, "+x", "-y", pixel_size, image_size, trusted_range
-        )
-        return d
\ No newline at end of file
+        return self._build_detector()
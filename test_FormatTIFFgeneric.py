@@ -0,0 +1,134 @@
+"""Checks of the raw TIFF header reader in FormatTIFFgeneric against files
+written, and read back, by tifffile"""
+
+import struct
+
+import pytest
+
+np = pytest.importorskip("numpy")
+tifffile = pytest.importorskip("tifffile")
+pytest.importorskip("dxtbx")
+
+import FormatTIFFgeneric as ftg
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16", "int16", "int32", "float32"])
+@pytest.mark.parametrize("byteorder", ["<", ">"])
+@pytest.mark.parametrize("bigtiff", [False, True])
+@pytest.mark.parametrize("rowsperstrip", [None, 7])
+def test_round_trip(tmp_path, dtype, byteorder, bigtiff, rowsperstrip):
+    data = (np.arange(40 * 30) % 251 - 100).reshape(40, 30)
+    if dtype.startswith("uint"):
+        data = abs(data)
+    data = data.astype(dtype)
+    image_file = str(tmp_path / "image_001.tif")
+    tifffile.imwrite(
+        image_file,
+        data,
+        byteorder=byteorder,
+        bigtiff=bigtiff,
+        rowsperstrip=rowsperstrip,
+        photometric="minisblack",
+    )
+
+    header = ftg._fast_header(image_file)
+    assert header.byte_order == byteorder
+    assert header.next_ifd == 0
+    assert header.shape == (40, 30)
+    offset, layout_dtype = header.uncompressed_layout()
+    assert layout_dtype == np.dtype(dtype).newbyteorder(byteorder)
+
+    assert ftg.FormatTIFFgeneric.understand(image_file)
+    raw_data = ftg.FormatTIFFgeneric(image_file).get_raw_data()
+    assert np.array_equal(raw_data.as_numpy_array(), tifffile.imread(image_file))
+    if dtype != "float32":
+        assert isinstance(raw_data, ftg.flex.int)
+
+
+def test_multiple_pages_rejected(tmp_path):
+    image_file = str(tmp_path / "stack_001.tif")
+    tifffile.imwrite(image_file, np.zeros((2, 16, 16), dtype="uint16"))
+
+    assert ftg._fast_header(image_file).next_ifd
+    assert not ftg.FormatTIFFgeneric.understand(image_file)
+
+
+def test_not_tiff_rejected(tmp_path):
+    image_file = tmp_path / "image_001.img"
+    image_file.write_bytes(b"not a TIFF file at all")
+
+    assert ftg._fast_header(str(image_file)) is None
+    assert not ftg.FormatTIFFgeneric.understand(str(image_file))
+
+
+def test_asi_description(tmp_path):
+    image_file = str(tmp_path / "glycine_001.tif")
+    tifffile.imwrite(
+        image_file,
+        np.zeros((516, 516), dtype="uint16"),
+        description="ImageCameraName: timepix",
+        metadata=None,
+    )
+
+    assert ftg.FormatTIFFgeneric.understand(image_file)
+    assert ftg.FormatTIFFgeneric_ASI.understand(image_file)
+    assert not ftg.FormatTIFFgeneric_Medipix.understand(image_file)
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16", "int32"])
+def test_truncated_strip(tmp_path, dtype):
+    image_file = str(tmp_path / "image_001.tif")
+    tifffile.imwrite(image_file, np.ones((64, 64), dtype=dtype))
+    offset, _ = ftg._fast_header(image_file).uncompressed_layout()
+    with open(image_file, "r+b") as f:
+        f.truncate(offset + 64 * 64 * np.dtype(dtype).itemsize // 2)
+
+    assert ftg._fast_header(image_file).uncompressed_layout() is None
+    with pytest.raises(Exception):
+        ftg.FormatTIFFgeneric(image_file).get_raw_data()
+
+
+def _classic_tiff(entries, next_ifd=0, pad=64):
+    """A little-endian classic TIFF with one IFD at offset 8 holding entries of
+    (tag, type, count, value bytes), padded with zeros"""
+
+    data = b"II" + struct.pack("<HI", 42, 8) + struct.pack("<H", len(entries))
+    for tag, dtype, count, value in entries:
+        data += struct.pack("<HHI4s", tag, dtype, count, value.ljust(4, b"\0"))
+    return data + struct.pack("<I", next_ifd) + b"\0" * pad
+
+
+_SHAPE_ENTRIES = [
+    (256, 3, 1, struct.pack("<H", 4)),
+    (257, 3, 1, struct.pack("<H", 4)),
+]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        # StripOffsets with a count far beyond the file size
+        _classic_tiff(_SHAPE_ENTRIES + [(273, 4, 0xFFFFFFF0, struct.pack("<I", 64))]),
+        # StripOffsets values stored beyond the end of the file
+        _classic_tiff(_SHAPE_ENTRIES + [(273, 4, 4, struct.pack("<I", 10 ** 6))]),
+        # Classic TIFF IFD beyond the end of the file
+        b"II" + struct.pack("<HI", 42, 10 ** 6) + b"\0" * 64,
+        # BigTIFF IFD entry count of 2**62
+        b"II" + struct.pack("<HHHQQ", 43, 8, 0, 16, 2 ** 62) + b"\0" * 64,
+        # BigTIFF IFD offset above 2**63
+        b"II" + struct.pack("<HHHQ", 43, 8, 0, 2 ** 63 + 16) + b"\0" * 64,
+        # Header cut off in the middle of the IFD
+        _classic_tiff(_SHAPE_ENTRIES, pad=0)[:20],
+    ],
+)
+def test_malformed_header(tmp_path, data):
+    image_file = tmp_path / "image_001.tif"
+    image_file.write_bytes(data)
+    image_file = str(image_file)
+
+    header = ftg._fast_header(image_file)
+    assert header.truncated
+    assert header.uncompressed_layout() is None
+    assert not ftg.FormatTIFFgeneric.understand(image_file)
+    with pytest.raises(ValueError):
+        ftg.FormatTIFFgeneric(image_file).get_raw_data()